@@ -1,13 +1,25 @@
 #!/usr/bin/env python3
 import os
+import gc
+import shutil
 import tempfile
 import asyncio
-from typing import Optional, Dict, Any
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterable
+import numpy as np
+import ffmpeg
 import torch
 import whisper_timestamped as whisper
+from whisper_timestamped.transcribe import disable_sdpa, get_vad_segments
 from fastapi import FastAPI, File, UploadFile, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 import aiofiles
+import aiohttp
 import uvicorn
 import logging
 
@@ -15,17 +27,58 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(
-    title="Whisper Timestamped Microservice",
-    description="Speech-to-text with timestamps using whisper-timestamped",
-    version="1.0.0"
-)
+# Inference-only service: fixed-shape convolutions, TF32 matmuls and no autograd
+torch.backends.cudnn.benchmark = True
+torch.set_float32_matmul_precision("high")
+torch.set_grad_enabled(False)
+
+# Global model cache, least recently used first
+MODEL_CACHE = OrderedDict()
+MODEL_CACHE_LOCK = threading.Lock()
+# One lock per cache key, so a model is only loaded once while other keys stay available
+MODEL_LOAD_LOCKS: Dict[str, threading.Lock] = {}
+MODEL_CACHE_SIZE = int(os.environ.get("MODEL_CACHE_SIZE", 3))
+MIN_FREE_GPU_MEMORY = int(float(os.environ.get("MIN_FREE_GPU_MEMORY_GB", 4)) * 2**30)
+
+# Inference backend: "timestamped" (whisper-timestamped) or "faster" (faster-whisper)
+BACKEND = os.environ.get("BACKEND", "timestamped")
+
+# 30s windows decoded together by the long-form backend
+LONG_FORM_BATCH_SIZE = int(os.environ.get("LONG_FORM_BATCH_SIZE", 8))
 
-# Global model cache
-MODEL_CACHE = {}
+# One inference thread per device. CUDA graph trees are per thread, so the
+# graphs captured during warmup are only replayed on the thread that captured them.
+INFERENCE_POOLS: Dict[str, ThreadPoolExecutor] = {}
+
+# Long-form requests waiting to share encoder and decoder batches, per model and device
+LONG_FORM_QUEUES: Dict[Tuple[str, str], asyncio.Queue] = {}
+LONG_FORM_WORKERS: Dict[Tuple[str, str], asyncio.Task] = {}
+
+# Skip non-speech audio with Silero VAD unless a request opts out
+VAD_FILTER = os.environ.get("VAD_FILTER", "1") == "1"
+
+# Startup warmup settings
+PRELOAD_MODEL = os.environ.get("PRELOAD_MODEL", "base")
+COMPILE_MODEL = os.environ.get("COMPILE_MODEL", "1") == "1"
+WARMUP_PASSES = 3
 
 # Supported audio formats
-SUPPORTED_FORMATS = {'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.wma', '.aac'}
+SUPPORTED_FORMATS = frozenset({'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.wma', '.aac'})
+_SUPPORTED_SUFFIXES = tuple(SUPPORTED_FORMATS)
+
+# MP4 containers may keep their index at the end of the file, which ffmpeg can't seek to through a pipe
+SEEKABLE_FORMATS = frozenset({'.m4a', '.mp4'})
+_SEEKABLE_SUFFIXES = tuple(SEEKABLE_FORMATS)
+_SEEKABLE_CONTENT_TYPES = ('mp4', 'm4a')
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+
+# Uploads are read in chunks of this size instead of all at once
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Seekable uploads are staged in a fixed ring of reusable files on tmpfs
+TMPFS_DIR = os.environ.get("TMPFS_DIR", "/dev/shm")
+TEMP_SLOT_COUNT = int(os.environ.get("TEMP_SLOT_COUNT", 32))
+TEMP_SLOTS = asyncio.Queue()
 
 def get_device_info():
     """Get available device information"""
@@ -44,6 +97,13 @@ def get_device_info():
     
     return device_info
 
+def get_inference_pool(device: str) -> ThreadPoolExecutor:
+    """Get the single-thread executor that runs all inference on a device"""
+    if device not in INFERENCE_POOLS:
+        INFERENCE_POOLS[device] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"infer-{device}")
+    return INFERENCE_POOLS[device]
+
+@functools.lru_cache(maxsize=1)
 def get_optimal_device():
     """Determine the best available device"""
     if torch.cuda.is_available():
@@ -53,24 +113,465 @@ def get_optimal_device():
     else:
         return "cpu"
 
-def load_model(model_name: str = "base", device: Optional[str] = None):
+async def read_chunks(file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """Yield an upload in fixed-size chunks"""
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+async def decode_audio(chunks: AsyncIterable[bytes]) -> np.ndarray:
+    """Decode a stream of audio chunks to a 16 kHz mono float32 waveform through an ffmpeg pipe"""
+    args = (
+        ffmpeg
+        .input("pipe:0")
+        .output("pipe:1", format="s16le", acodec="pcm_s16le", ac=1, ar=SAMPLE_RATE)
+        .global_args("-loglevel", "error")
+        .compile()
+    )
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    
+    async def feed():
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg stopped reading, its exit status reports why
+            pass
+        finally:
+            process.stdin.close()
+    
+    feeder = asyncio.create_task(feed())
+    try:
+        out, err = await process.communicate()
+        await feeder
+    finally:
+        if process.returncode is None:
+            process.kill()
+        feeder.cancel()
+    
+    # ffmpeg can exit cleanly without producing audio, e.g. when it can't seek back to an MP4 index
+    err = err.decode(errors='ignore').strip()
+    if process.returncode != 0 or not out:
+        raise RuntimeError(f"ffmpeg failed to decode audio: {err or 'no audio decoded'}")
+    if err:
+        # Recoverable errors such as corrupt frames or a truncated tail, whisper.load_audio accepts these too
+        logger.warning(f"ffmpeg reported errors while decoding audio: {err}")
+    
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+async def load_audio_file(chunks: AsyncIterable[bytes]) -> np.ndarray:
+    """Decode audio that ffmpeg needs to seek in through a reusable temporary slot"""
+    slot = await TEMP_SLOTS.get()
+    try:
+        async with aiofiles.open(slot, "wb") as out:
+            async for chunk in chunks:
+                await out.write(chunk)
+        return await asyncio.to_thread(whisper.load_audio, slot)
+    finally:
+        # Hand the tmpfs memory back before the slot is reused
+        if os.path.exists(slot):
+            os.truncate(slot, 0)
+        TEMP_SLOTS.put_nowait(slot)
+
+def create_temp_slots() -> str:
+    """Create this process's slot directory, on tmpfs when available, and fill the slot ring"""
+    base_dir = TMPFS_DIR if os.path.isdir(TMPFS_DIR) else tempfile.gettempdir()
+    slot_dir = os.path.join(base_dir, f"whisper-{os.getpid()}")
+    os.makedirs(slot_dir, exist_ok=True)
+    
+    for i in range(TEMP_SLOT_COUNT):
+        TEMP_SLOTS.put_nowait(os.path.join(slot_dir, f"slot_{i}"))
+    
+    return slot_dir
+
+def gpu_memory_low(device: str) -> bool:
+    """Check whether a CUDA device is below the free memory threshold"""
+    if not device.startswith("cuda") or not torch.cuda.is_available():
+        return False
+    free, _ = torch.cuda.mem_get_info(device)
+    return free < MIN_FREE_GPU_MEMORY
+
+def evict_models(device: str):
+    """Drop least recently used models until there is room for another one"""
+    while MODEL_CACHE and (len(MODEL_CACHE) >= MODEL_CACHE_SIZE or gpu_memory_low(device)):
+        cache_key = next(iter(MODEL_CACHE))
+        del MODEL_CACHE[cache_key]
+        logger.info(f"Evicted model {cache_key} from cache")
+        
+        # Release the weights before measuring free memory again
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+def model_size_bytes(model) -> Optional[int]:
+    """Bytes held by a PyTorch model's parameters and buffers"""
+    if not isinstance(model, torch.nn.Module):
+        return None
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+def load_model(model_name: str = "base", device: Optional[str] = None, backend: str = BACKEND):
     """Load whisper model with caching"""
     if device is None:
         device = get_optimal_device()
     
-    cache_key = f"{model_name}_{device}"
+    cache_key = f"{model_name}_{device}" if backend != "faster" else f"{model_name}_{device}_faster"
+    
+    with MODEL_CACHE_LOCK:
+        if cache_key in MODEL_CACHE:
+            MODEL_CACHE.move_to_end(cache_key)
+            return MODEL_CACHE[cache_key]
+        load_lock = MODEL_LOAD_LOCKS.setdefault(cache_key, threading.Lock())
     
-    if cache_key not in MODEL_CACHE:
+    # Loading can take minutes, so only threads waiting for this same model block on it
+    with load_lock:
+        with MODEL_CACHE_LOCK:
+            if cache_key in MODEL_CACHE:
+                MODEL_CACHE.move_to_end(cache_key)
+                return MODEL_CACHE[cache_key]
+            evict_models(device)
+        
         logger.info(f"Loading model {model_name} on device {device}")
         try:
-            model = whisper.load_model(model_name, device=device)
-            MODEL_CACHE[cache_key] = model
-            logger.info(f"Model {model_name} loaded successfully on {device}")
+            if backend == "faster":
+                from faster_whisper import WhisperModel
+                
+                # CTranslate2 runs on CUDA or CPU only, with int8 weights
+                on_cuda = device.startswith("cuda")
+                model = WhisperModel(
+                    model_name,
+                    device="cuda" if on_cuda else "cpu",
+                    compute_type="int8_float16" if on_cuda else "int8",
+                    cpu_threads=os.cpu_count()
+                )
+            else:
+                model = whisper.load_model(model_name, device=device)
+                # Inference only: leave training mode and stop tracking parameter gradients
+                model.eval()
+                model.requires_grad_(False)
         except Exception as e:
             logger.error(f"Failed to load model {model_name} on {device}: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to load model: {e}")
+        
+        with MODEL_CACHE_LOCK:
+            MODEL_CACHE[cache_key] = model
+        logger.info(f"Model {model_name} loaded successfully on {device}")
+        return model
+
+def preload_vad():
+    """Load Silero VAD now, whisper-timestamped fetches it through torch.hub on first use"""
+    global VAD_FILTER
+    try:
+        get_vad_segments(torch.zeros(SAMPLE_RATE), method="silero")
+    except Exception as e:
+        # Every request using the default would fail on it, so transcribe without VAD instead
+        logger.warning(f"Failed to load Silero VAD, disabling VAD by default: {e}")
+        VAD_FILTER = False
+
+def warmup_model(model_name: str, device: Optional[str] = None):
+    """Preload a model, compile its encoder on CUDA and transcribe silence through it"""
+    if device is None:
+        device = get_optimal_device()
+    
+    whisper_model = load_model(model_name, device)
+    if BACKEND == "faster":
+        return
+    on_cuda = device.startswith("cuda")
+    
+    # Cache the mel filterbank up front instead of reading it from disk on the first request.
+    # whisper-timestamped computes mels on the CPU, so that is the cache entry requests hit.
+    whisper.audio.mel_filters(torch.device("cpu"), whisper_model.dims.n_mels)
+    
+    # whisper-timestamped hooks encoder.conv1 and the decoder on every call,
+    # so only the hook-free encoder blocks are compiled. They are specialised
+    # to static shapes: each shape and SDPA setting gets its own graph, so the
+    # warmup below has to run every shape requests will use.
+    eager_blocks = list(whisper_model.encoder.blocks)
+    compiled = COMPILE_MODEL and on_cuda
+    if compiled:
+        logger.info(f"Compiling encoder of model {model_name}")
+        for i, block in enumerate(eager_blocks):
+            whisper_model.encoder.blocks[i] = torch.compile(
+                block, mode="reduce-overhead", fullgraph=True, dynamic=False
+            )
+    
+    # Transcribe 30s of silence so tracing and CUDA graph capture happen on the
+    # same code path as requests, including whisper-timestamped's disable_sdpa().
+    # whisper pads every window to N_FRAMES, so this covers the [1, n_mels, N_FRAMES] shape.
+    # Compiled models encode long-form audio in full [LONG_FORM_BATCH_SIZE, n_mels, N_FRAMES] batches.
+    silence = np.zeros(whisper.audio.N_SAMPLES, dtype=np.float32)
+    long_form_batch = torch.zeros(
+        LONG_FORM_BATCH_SIZE, whisper_model.dims.n_mels, whisper.audio.N_FRAMES,
+        device=device,
+        dtype=torch.float16 if on_cuda else torch.float32
+    )
     
-    return MODEL_CACHE[cache_key]
+    def run_warmup(passes: int):
+        with torch.inference_mode():
+            for _ in range(passes):
+                whisper.transcribe(whisper_model, silence, vad=False)
+                if whisper_model.encoder_compiled:
+                    encode_windows(whisper_model, long_form_batch)
+    
+    whisper_model.encoder_compiled = compiled
+    try:
+        run_warmup(WARMUP_PASSES if compiled else 1)
+    except Exception as e:
+        if not compiled:
+            raise
+        logger.warning(f"Compiled warmup failed, falling back to eager mode: {e}")
+        for i, block in enumerate(eager_blocks):
+            whisper_model.encoder.blocks[i] = block
+        whisper_model.encoder_compiled = False
+        run_warmup(1)
+    
+    if on_cuda:
+        torch.cuda.synchronize()
+    logger.info(f"Model {model_name} warmed up on {device}")
+
+def transcribe_faster(model, audio, language: Optional[str] = None, vad: bool = True, verbose: bool = False) -> Dict[str, Any]:
+    """Transcribe with faster-whisper and shape the result like whisper-timestamped"""
+    segments, info = model.transcribe(
+        audio,
+        language=language,
+        word_timestamps=True,
+        vad_filter=vad,
+        beam_size=1
+    )
+    
+    result_segments = []
+    for index, segment in enumerate(segments):
+        words = [
+            {
+                "text": word.word.strip(),
+                "start": round(word.start, 2),
+                "end": round(word.end, 2),
+                "confidence": round(word.probability, 3)
+            }
+            for word in segment.words or []
+        ]
+        confidence = sum(word["confidence"] for word in words) / len(words) if words else 0.0
+        result_segments.append({
+            "id": index,
+            "seek": segment.seek,
+            "start": round(segment.start, 2),
+            "end": round(segment.end, 2),
+            "text": segment.text,
+            "tokens": segment.tokens,
+            "temperature": segment.temperature,
+            "avg_logprob": segment.avg_logprob,
+            "compression_ratio": segment.compression_ratio,
+            "no_speech_prob": segment.no_speech_prob,
+            "confidence": round(confidence, 3),
+            "words": words
+        })
+        if verbose:
+            logger.info(f"[{segment.start:.2f} --> {segment.end:.2f}] {segment.text}")
+    
+    return {
+        "text": "".join(segment["text"] for segment in result_segments),
+        "segments": result_segments,
+        "language": info.language
+    }
+
+def encode_windows(model, windows: torch.Tensor) -> torch.Tensor:
+    """Encode up to LONG_FORM_BATCH_SIZE mel windows, padded to the warmed-up batch shape on compiled models"""
+    count = len(windows)
+    # Padding only pays off when it lets a compiled encoder replay its static-shape graph
+    if getattr(model, "encoder_compiled", False):
+        windows = torch.nn.functional.pad(windows, (0, 0, 0, 0, 0, LONG_FORM_BATCH_SIZE - count))
+    # Same attention path as whisper-timestamped, which the compiled blocks are specialised to
+    with disable_sdpa():
+        return model.encoder(windows)[:count]
+
+def batched_transcribe(model, jobs: List[Tuple[np.ndarray, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Transcribe the fixed 30s windows of several requests in shared batches, trading word timestamps and VAD for speed on long audio"""
+    n_samples = whisper.audio.N_SAMPLES
+    fp16 = model.device.type == "cuda"
+    
+    # Stack every request's windows, remembering which request and position each one came from
+    windows, owners, languages = [], [], []
+    for job, (audio, options) in enumerate(jobs):
+        # Pad to whole windows so the mel splits into [N, n_mels, N_FRAMES] with no partial window
+        waveform = torch.from_numpy(audio)
+        waveform = torch.nn.functional.pad(waveform, (0, -len(waveform) % n_samples))
+        mel = whisper.log_mel_spectrogram(waveform, model.dims.n_mels, device=model.device)
+        job_windows = mel.unfold(-1, whisper.audio.N_FRAMES, whisper.audio.N_FRAMES).permute(1, 0, 2)
+        windows.append(job_windows)
+        owners.extend((job, index) for index in range(len(job_windows)))
+        
+        # English-only models have no language tokens to detect
+        language = options.get("language")
+        if language is None and not model.is_multilingual:
+            language = "en"
+        languages.append(language)
+    windows = torch.cat(windows)
+    if fp16:
+        windows = windows.half()
+    
+    segments = [[] for _ in jobs]
+    for offset in range(0, len(windows), LONG_FORM_BATCH_SIZE):
+        features = encode_windows(model, windows[offset:offset + LONG_FORM_BATCH_SIZE])
+        batch_owners = owners[offset:offset + LONG_FORM_BATCH_SIZE]
+        
+        # Detect each request's language once, from its first window, so all its windows decode consistently
+        undetected = [row for row, (job, index) in enumerate(batch_owners) if index == 0 and languages[job] is None]
+        if undetected:
+            with disable_sdpa():
+                _, probs = whisper.detect_language(model, features[undetected])
+            for row, window_probs in zip(undetected, probs):
+                languages[batch_owners[row][0]] = max(window_probs, key=window_probs.get)
+        
+        # whisper.decode takes one language per call, and encoded features skip its encoder
+        rows_by_language = {}
+        for row, (job, _) in enumerate(batch_owners):
+            rows_by_language.setdefault(languages[job], []).append(row)
+        for language, rows in rows_by_language.items():
+            options = whisper.DecodingOptions(language=language, fp16=fp16, without_timestamps=True)
+            with disable_sdpa():
+                results = whisper.decode(model, features[rows], options)
+            for row, result in zip(rows, results):
+                # Same silence rule as whisper.transcribe's defaults
+                if result.no_speech_prob > 0.6 and result.avg_logprob < -1.0:
+                    continue
+                job, index = batch_owners[row]
+                audio, job_options = jobs[job]
+                start = index * n_samples / SAMPLE_RATE
+                end = min(start + n_samples / SAMPLE_RATE, len(audio) / SAMPLE_RATE)
+                segments[job].append({
+                    "id": len(segments[job]),
+                    "seek": index * whisper.audio.N_FRAMES,
+                    "start": round(start, 2),
+                    "end": round(end, 2),
+                    "text": result.text,
+                    "tokens": result.tokens,
+                    "temperature": result.temperature,
+                    "avg_logprob": result.avg_logprob,
+                    "compression_ratio": result.compression_ratio,
+                    "no_speech_prob": result.no_speech_prob
+                })
+                if job_options.get("verbose"):
+                    logger.info(f"[{start:.2f} --> {end:.2f}] {result.text}")
+    
+    return [
+        {
+            "text": " ".join(segment["text"] for segment in job_segments),
+            "segments": job_segments,
+            "language": language
+        }
+        for job_segments, language in zip(segments, languages)
+    ]
+
+def select_backend(precise_timestamps: bool, long_form: bool) -> str:
+    """Pick the transcription backend for a request"""
+    if long_form:
+        return "batched"
+    return "timestamped" if precise_timestamps else BACKEND
+
+def run_transcription(model_name: str, device: Optional[str], backend: str, audio, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Load the requested model and transcribe one waveform with it"""
+    whisper_model = load_model(model_name, device, backend)
+    transcribe = transcribe_faster if backend == "faster" else whisper.transcribe
+    
+    with torch.inference_mode():
+        return transcribe(whisper_model, audio, **options)
+
+def run_long_form_batch(model_name: str, device: str, jobs: List[Tuple[np.ndarray, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Load the requested model and transcribe several long-form waveforms in shared batches"""
+    whisper_model = load_model(model_name, device, "batched")
+    with torch.inference_mode():
+        return batched_transcribe(whisper_model, jobs)
+
+async def long_form_worker(model_name: str, device: str, queue: asyncio.Queue):
+    """Transcribe queued long-form requests together so their windows fill the same batches"""
+    loop = asyncio.get_running_loop()
+    while True:
+        # Requests that queued up while the previous group ran join the next one, nothing waits for more.
+        # Groups are capped at LONG_FORM_BATCH_SIZE requests so their mels on the device stay bounded.
+        items = [await queue.get()]
+        while len(items) < LONG_FORM_BATCH_SIZE and not queue.empty():
+            items.append(queue.get_nowait())
+        
+        try:
+            results = await loop.run_in_executor(
+                get_inference_pool(device),
+                functools.partial(run_long_form_batch, model_name, device, [job for job, _ in items])
+            )
+        except Exception as e:
+            results = [e] * len(items)
+        
+        for (_, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+async def submit_for_transcription(audio, model_name: str, device: Optional[str], backend: str, **options) -> Dict[str, Any]:
+    """Run a transcription on its device's inference thread, long-form requests through their shared queue"""
+    target = device or get_optimal_device()
+    if backend != "batched":
+        return await asyncio.get_running_loop().run_in_executor(
+            get_inference_pool(target),
+            functools.partial(run_transcription, model_name, device, backend, audio, options)
+        )
+    
+    key = (model_name, target)
+    if key not in LONG_FORM_QUEUES:
+        LONG_FORM_QUEUES[key] = asyncio.Queue()
+        LONG_FORM_WORKERS[key] = asyncio.create_task(long_form_worker(model_name, target, LONG_FORM_QUEUES[key]))
+    
+    future = asyncio.get_running_loop().create_future()
+    await LONG_FORM_QUEUES[key].put(((audio, options), future))
+    return await future
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up the default model and start background workers for the lifetime of the service"""
+    # Probe devices once, health checks serve the cached result
+    app.state.device_info = get_device_info()
+    
+    if VAD_FILTER:
+        await asyncio.to_thread(preload_vad)
+    
+    # Warm up on the inference thread that will serve requests for this device
+    if PRELOAD_MODEL:
+        device = get_optimal_device()
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                get_inference_pool(device),
+                functools.partial(warmup_model, PRELOAD_MODEL, device)
+            )
+        except Exception as e:
+            logger.error(f"Failed to preload model {PRELOAD_MODEL}: {e}")
+    
+    slot_dir = create_temp_slots()
+    
+    # One shared HTTP session so URL downloads reuse connections
+    app.state.http = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+    )
+    yield
+    for worker in LONG_FORM_WORKERS.values():
+        worker.cancel()
+    for pool in INFERENCE_POOLS.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+    await app.state.http.close()
+    shutil.rmtree(slot_dir, ignore_errors=True)
+
+app = FastAPI(
+    title="Whisper Timestamped Microservice",
+    description="Speech-to-text with timestamps using whisper-timestamped",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 @app.get("/")
 async def root():
@@ -78,7 +579,7 @@ async def root():
     return {
         "status": "healthy",
         "service": "whisper-timestamped",
-        "device_info": get_device_info()
+        "device_info": app.state.device_info
     }
 
 @app.get("/health")
@@ -86,7 +587,7 @@ async def health():
     """Detailed health check"""
     return {
         "status": "healthy",
-        "device_info": get_device_info(),
+        "device_info": app.state.device_info,
         "supported_formats": list(SUPPORTED_FORMATS),
         "available_models": ["tiny", "base", "small", "medium", "large", "large-v2", "large-v3"]
     }
@@ -98,43 +599,41 @@ async def transcribe_audio(
     language: Optional[str] = Query(default=None, description="Language code (auto-detect if None)"),
     device: Optional[str] = Query(default=None, description="Device to use (auto if None)"),
     word_timestamps: bool = Query(default=True, description="Include word-level timestamps"),
+    precise_timestamps: bool = Query(default=False, description="Always use whisper-timestamped for word alignment"),
+    long_form: bool = Query(default=False, description="Decode 30s windows in batches, without word timestamps"),
+    vad: Optional[bool] = Query(default=None, description="Skip non-speech audio with voice activity detection (service default if None)"),
     verbose: bool = Query(default=False, description="Verbose output")
 ):
     """Transcribe audio file with timestamps"""
     
     # Validate file format
-    file_extension = os.path.splitext(file.filename)[1].lower()
-    if file_extension not in SUPPORTED_FORMATS:
+    filename = file.filename.lower()
+    if not filename.endswith(_SUPPORTED_SUFFIXES):
         raise HTTPException(
             status_code=400, 
             detail=f"Unsupported file format. Supported formats: {list(SUPPORTED_FORMATS)}"
         )
     
-    # Create temporary file
-    temp_file = None
     try:
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-        
-        # Load the appropriate model
-        whisper_model = load_model(model, device)
+        # Stream the upload into the decoder without buffering it whole
+        if filename.endswith(_SEEKABLE_SUFFIXES):
+            audio = await load_audio_file(read_chunks(file))
+        else:
+            audio = await decode_audio(read_chunks(file))
         
         # Transcribe with timestamps
         logger.info(f"Transcribing {file.filename} with model {model}")
         
-        result = whisper.transcribe(
-            whisper_model,
-            temp_file_path,
+        result = await submit_for_transcription(
+            audio,
+            model,
+            device,
+            select_backend(precise_timestamps, long_form),
             language=language,
+            vad=VAD_FILTER if vad is None else vad,
             verbose=verbose
         )
         
-        # Clean up temporary file
-        os.unlink(temp_file_path)
-        
         # Format response
         response = {
             "text": result["text"],
@@ -146,13 +645,9 @@ async def transcribe_audio(
         }
         
         logger.info(f"Transcription completed for {file.filename}")
-        return JSONResponse(content=response)
+        return ORJSONResponse(response)
         
     except Exception as e:
-        # Clean up temporary file if it exists
-        if temp_file and os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        
         logger.error(f"Transcription failed: {e}")
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
 
@@ -163,42 +658,42 @@ async def transcribe_from_url(
     language: Optional[str] = Query(default=None, description="Language code (auto-detect if None)"),
     device: Optional[str] = Query(default=None, description="Device to use (auto if None)"),
     word_timestamps: bool = Query(default=True, description="Include word-level timestamps"),
+    precise_timestamps: bool = Query(default=False, description="Always use whisper-timestamped for word alignment"),
+    long_form: bool = Query(default=False, description="Decode 30s windows in batches, without word timestamps"),
+    vad: Optional[bool] = Query(default=None, description="Skip non-speech audio with voice activity detection (service default if None)"),
     verbose: bool = Query(default=False, description="Verbose output")
 ):
     """Transcribe audio from URL"""
     try:
-        import requests
-        
         # Download file from URL
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        # Get content type and determine file extension
-        content_type = response.headers.get('content-type', '')
-        if 'audio' not in content_type.lower():
-            logger.warning(f"Content type {content_type} might not be audio")
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.tmp') as temp_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                temp_file.write(chunk)
-            temp_file_path = temp_file.name
-        
-        # Load model and transcribe
-        whisper_model = load_model(model, device)
+        async with app.state.http.get(url) as response:
+            response.raise_for_status()
+            
+            # Get content type and determine file extension
+            content_type = response.headers.get('content-type', '')
+            if 'audio' not in content_type.lower():
+                logger.warning(f"Content type {content_type} might not be audio")
+            
+            # MP4 downloads go through a seekable file, everything else streams straight into the decoder
+            chunks = response.content.iter_chunked(65536)
+            if (any(t in content_type.lower() for t in _SEEKABLE_CONTENT_TYPES)
+                    or urlparse(url).path.lower().endswith(_SEEKABLE_SUFFIXES)):
+                audio = await load_audio_file(chunks)
+            else:
+                audio = await decode_audio(chunks)
         
         logger.info(f"Transcribing audio from URL: {url}")
         
-        result = whisper.transcribe(
-            whisper_model,
-            temp_file_path,
+        result = await submit_for_transcription(
+            audio,
+            model,
+            device,
+            select_backend(precise_timestamps, long_form),
             language=language,
+            vad=VAD_FILTER if vad is None else vad,
             verbose=verbose
         )
         
-        # Clean up
-        os.unlink(temp_file_path)
-        
         response_data = {
             "text": result["text"],
             "language": result.get("language", "unknown"),
@@ -208,7 +703,7 @@ async def transcribe_from_url(
             "source_url": url
         }
         
-        return JSONResponse(content=response_data)
+        return ORJSONResponse(response_data)
         
     except Exception as e:
         logger.error(f"URL transcription failed: {e}")
@@ -218,12 +713,25 @@ async def transcribe_from_url(
 async def list_models():
     """List available models and their status"""
     models = ["tiny", "base", "small", "medium", "large", "large-v2", "large-v3"]
-    loaded_models = list(MODEL_CACHE.keys())
+    cached = list(MODEL_CACHE.items())
     
     return {
         "available_models": models,
-        "loaded_models": loaded_models,
-        "device_info": get_device_info()
+        "loaded_models": [cache_key for cache_key, _ in cached],
+        "resident_bytes": {cache_key: model_size_bytes(model) for cache_key, model in cached},
+        "gpu_memory_allocated": torch.cuda.memory_allocated() if torch.cuda.is_available() else 0,
+        "device_info": app.state.device_info
+    }
+
+@app.post("/admin/refresh-devices")
+async def refresh_devices():
+    """Probe devices again and replace the cached device information"""
+    get_optimal_device.cache_clear()
+    app.state.device_info = get_device_info()
+    
+    return {
+        "device_info": app.state.device_info,
+        "optimal_device": get_optimal_device()
     }
 
 if __name__ == "__main__":
@@ -237,6 +745,9 @@ if __name__ == "__main__":
         "app:app",
         host=host,
         port=port,
+        workers=int(os.environ.get("WORKERS", 1)),
+        loop="uvloop",
+        http="httptools",
         reload=False,
         log_level="info"
     )
\ No newline at end of file
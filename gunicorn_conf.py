@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Gunicorn configuration running one uvicorn worker per GPU
+
+Usage: gunicorn -c gunicorn_conf.py app:app
+"""
+import os
+import shutil
+import subprocess
+
+def gpu_count():
+    """Count GPUs with nvidia-smi so the master never initializes CUDA before forking"""
+    if shutil.which("nvidia-smi") is None:
+        return 0
+    try:
+        output = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return 0
+    return sum(1 for line in output.splitlines() if line.startswith("GPU "))
+
+GPU_COUNT = int(os.environ.get("GPU_COUNT", gpu_count()))
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("WORKERS", GPU_COUNT or 1))
+# UvicornWorker picks uvloop and httptools when they are installed
+worker_class = "uvicorn.workers.UvicornWorker"
+# Model loading and warmup happen at startup
+timeout = 300
+
+# Workers currently pinned to each GPU, tracked in the master
+GPU_WORKERS = [0] * GPU_COUNT
+
+def pre_fork(server, worker):
+    """Assign the least used GPU before forking, so replacement workers take over the GPU that was freed"""
+    if GPU_COUNT:
+        worker.gpu = min(range(GPU_COUNT), key=GPU_WORKERS.__getitem__)
+        GPU_WORKERS[worker.gpu] += 1
+
+def post_fork(server, worker):
+    """Pin each worker to its assigned GPU"""
+    if GPU_COUNT:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(worker.gpu)
+        server.log.info(f"Worker {worker.pid} pinned to GPU {worker.gpu}")
+
+def child_exit(server, worker):
+    """Release the GPU of a worker that exited"""
+    if GPU_COUNT:
+        GPU_WORKERS[worker.gpu] -= 1
@@ -7,6 +7,7 @@ import json
 import time
 import argparse
 from pathlib import Path
+import numpy as np
 
 class WhisperClient:
     def __init__(self, base_url="http://localhost:8000"):
@@ -86,20 +87,21 @@ class WhisperClient:
             print(f"URL transcription failed: {e}")
             return None
 
+def split_timestamps(times):
+    """Split an array of seconds into lists of minutes, seconds and milliseconds"""
+    # Plain ints format much faster than numpy scalars in f-strings
+    return (times // 60).astype(int).tolist(), (times % 60).astype(int).tolist(), ((times % 1) * 1000).astype(int).tolist()
+
 def format_timestamps(segments):
     """Format segment timestamps for display"""
-    formatted = []
-    for segment in segments:
-        start = segment.get('start', 0)
-        end = segment.get('end', 0)
-        text = segment.get('text', '').strip()
-        
-        start_time = f"{int(start//60):02d}:{int(start%60):02d}.{int((start%1)*1000):03d}"
-        end_time = f"{int(end//60):02d}:{int(end%60):02d}.{int((end%1)*1000):03d}"
-        
-        formatted.append(f"[{start_time} --> {end_time}] {text}")
+    starts = np.fromiter((s.get('start', 0) for s in segments), dtype=np.float64, count=len(segments))
+    ends = np.fromiter((s.get('end', 0) for s in segments), dtype=np.float64, count=len(segments))
+    texts = [s.get('text', '').strip() for s in segments]
     
-    return formatted
+    return [
+        f"[{sm:02d}:{ss:02d}.{sms:03d} --> {em:02d}:{es:02d}.{ems:03d}] {text}"
+        for sm, ss, sms, em, es, ems, text in zip(*split_timestamps(starts), *split_timestamps(ends), texts)
+    ]
 
 def main():
     parser = argparse.ArgumentParser(description="Test Whisper Timestamped Service")
@@ -87,7 +87,8 @@ def test_endpoints_defined():
             '@app.get("/health")',
             '@app.post("/transcribe")',
             '@app.post("/transcribe-url")',
-            '@app.get("/models")'
+            '@app.get("/models")',
+            '@app.post("/admin/refresh-devices")'
         ]
         
         for endpoint in expected_endpoints:
@@ -102,6 +103,41 @@ def test_endpoints_defined():
         print(f"❌ Endpoints test failed: {e}")
         return False
 
+def test_cached_functions():
+    """Test that every cache_clear() call in app.py targets an lru_cache-decorated function"""
+    try:
+        import ast
+        with open('app.py', 'r') as f:
+            tree = ast.parse(f.read())
+        
+        cached = {
+            node.name for node in ast.walk(tree)
+            if isinstance(node, ast.FunctionDef)
+            and any('lru_cache' in ast.unparse(decorator) for decorator in node.decorator_list)
+        }
+        cleared = {
+            node.func.value.id for node in ast.walk(tree)
+            if isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and node.func.attr == 'cache_clear'
+            and isinstance(node.func.value, ast.Name)
+        }
+        
+        if 'get_optimal_device' not in cached:
+            print("❌ get_optimal_device is not cached")
+            return False
+        for name in cleared:
+            if name in cached:
+                print(f"✅ {name}.cache_clear() targets a cached function")
+            else:
+                print(f"❌ {name}.cache_clear() targets a function without lru_cache")
+                return False
+        
+        return True
+    except Exception as e:
+        print(f"❌ Cached functions test failed: {e}")
+        return False
+
 def test_requirements():
     """Test that requirements.txt exists and has expected dependencies"""
     try:
@@ -136,6 +172,7 @@ def main():
         test_app_structure,
         test_supported_formats,
         test_endpoints_defined,
+        test_cached_functions,
         test_requirements
     ]
     